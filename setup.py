@@ -22,6 +22,10 @@ setuptools.setup(
         'pytest>=7.0.0',
         'httpretty~=1.1.3'
     ],
+    extras_require={
+        'httpx': ['httpx>=0.23.0'],
+        'owlrl': ['owlrl>=6.0.2']
+    },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Programming Language :: Python",
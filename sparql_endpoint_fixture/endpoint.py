@@ -1,31 +1,52 @@
 """pytest fixture for a HTTP SPARQL endpoint."""
+import hashlib
+import itertools
 import os
 import re
-from typing import Dict, Tuple, List, Callable, Union
+import threading
+from typing import Dict, Tuple, List, Callable, Union, Iterable, Optional
 from urllib.parse import parse_qs, urlparse
 
 import httpretty
 import pytest
 from httpretty.core import HTTPrettyRequest
 from pyparsing import ParseException
-from rdflib import ConjunctiveGraph, URIRef
+from rdflib import BNode, ConjunctiveGraph, URIRef, Variable
 from rdflib.plugins import sparql as sparql_options
 from rdflib.plugins.sparql import prepareQuery
 from rdflib.plugins.sparql.algebra import translateUpdate
+from rdflib.plugins.sparql.evaluate import evalPart
 from rdflib.plugins.sparql.parser import parseUpdate
 from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.sparql.sparql import FrozenBindings, QueryContext
 from rdflib.util import guess_format
 
+from sparql_endpoint_fixture.optimizer import GraphStatistics, StatisticsMemory, needs_reordering, reorder_bgps
+
 # Requests result in a return code, headers and body
 RequestResult = Tuple[int, Dict[str, str], str]
 Handler = Callable[[HTTPrettyRequest], RequestResult]
 PredefinedResponse = Union[RequestResult, Handler]
 
+# The pyparsing grammar behind the SPARQL parser is not thread safe, so parsing is
+# serialized when requests are handled concurrently. Evaluation is not.
+PARSE_LOCK = threading.Lock()
+
+# Synthetic variable identifying the VALUES row pushed down into a SERVICE evaluation
+SERVICE_ROW = Variable('__service_row')
+
 class Endpoint:
     """Handles SPARQL read/write queries."""
 
-    def load_rdf(self, rdf_file_or_text: str, graph: str = None):
-        """Load RDF data into graph."""
+    # Endpoints created during the current session, by URI, used to resolve SERVICE clauses in-process
+    registry: Dict[Union[str, re.Pattern], 'Endpoint'] = {}
+
+    # Maximum number of solutions pushed down into a single SERVICE evaluation as a VALUES block
+    SERVICE_BATCH_SIZE = 100
+
+    @staticmethod
+    def _read_rdf(rdf_file_or_text: str) -> Tuple[str, str]:
+        """Read RDF text and format from a file, or inline Turtle."""
         rdf_format = 'turtle'
         if os.path.isfile(rdf_file_or_text):
             rdf_format = guess_format(rdf_file_or_text)
@@ -33,6 +54,11 @@ class Endpoint:
                 rdf = rdf_file.read()
         else:
             rdf = rdf_file_or_text
+        return rdf, rdf_format
+
+    def load_rdf(self, rdf_file_or_text: str, graph: str = None):
+        """Load RDF data into graph."""
+        rdf, rdf_format = self._read_rdf(rdf_file_or_text)
         if graph:
             self.graph.get_context(graph).parse(data=rdf, format=rdf_format)
         else:
@@ -41,17 +67,25 @@ class Endpoint:
 
     def __init__(self, uri: str, initial_data: list, **kwargs):
         self.predefined = kwargs.get('predefined', {})
-        self.graph = ConjunctiveGraph()
+        self.graph = ConjunctiveGraph(store=StatisticsMemory())
+        # Reorder BGPs by estimated cardinality before evaluation, optionally printing the chosen order
+        self.optimize = kwargs.get('optimize', True)
+        self.explain_queries = kwargs.get('explain', False)
         # To work in isolation, disable loading external data
         sparql_options.SPARQL_LOAD_GRAPHS = False
         if 'default_graph_union' in kwargs:
             sparql_options.SPARQL_DEFAULT_GRAPH_UNION = kwargs['default_graph_union']
-        for arg in initial_data:
-            if isinstance(arg, dict):
-                for graph_name, payload in arg.items():
-                    self.load_rdf(payload, graph=graph_name)
-            else:
-                self.load_rdf(arg)
+        # Kept so that materialize() applies the same entailment after updates
+        self.entailment = kwargs.get('entailment')
+        self.inferred_graph = kwargs.get('inferred_graph')
+        if self.entailment:
+            self._load_entailed(initial_data, self.entailment,
+                                inferred_graph=self.inferred_graph,
+                                cache_dir=kwargs.get('entailment_cache'))
+        else:
+            self._load_initial(initial_data)
+
+        Endpoint.registry[uri] = self
 
         httpretty.register_uri(httpretty.GET, uri,
                                body=self._handle_get)
@@ -61,6 +95,84 @@ class Endpoint:
         # TODO handle GET/PUT/DELETE/POST/HEAD/PATCH for Graph Protocol
         # https://www.w3.org/TR/2013/REC-sparql11-http-rdf-update-20130321/
 
+    def _load_initial(self, initial_data: list):
+        for arg in initial_data:
+            if isinstance(arg, dict):
+                for graph_name, payload in arg.items():
+                    self.load_rdf(payload, graph=graph_name)
+            else:
+                self.load_rdf(arg)
+
+    def _load_entailed(self, initial_data: list, entailment: str,
+                       inferred_graph: str = None, cache_dir: str = None):
+        """Load initial data with its entailment closure, reusing a cached closure of the same data."""
+        cache_file = None
+        if cache_dir:
+            cache_file = os.path.join(cache_dir,
+                                      self._dataset_hash(initial_data, entailment, inferred_graph) + '.trig')
+            if os.path.isfile(cache_file):
+                self.graph.parse(cache_file, format='trig')
+                return
+
+        self._load_initial(initial_data)
+        self.materialize(entailment, inferred_graph)
+
+        if cache_file:
+            # Write to a temporary file first, so concurrent test processes never read a partial closure
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_file = f"{cache_file}.{os.getpid()}.tmp"
+            self.graph.serialize(temp_file, format='trig')
+            os.replace(temp_file, cache_file)
+
+    def _dataset_hash(self, initial_data: list, entailment: str, inferred_graph: str = None) -> str:
+        """Hash the content of the initial data, along with how its closure is materialized."""
+        # Optional dependency, only needed when entailment is requested
+        from sparql_endpoint_fixture.entailment import CLOSURE_VERSION
+
+        digest = hashlib.sha256(f"{CLOSURE_VERSION} {entailment} {inferred_graph}\n".encode('utf-8'))
+        for arg in initial_data:
+            for graph_name, payload in (arg.items() if isinstance(arg, dict) else [(None, arg)]):
+                rdf, rdf_format = self._read_rdf(payload)
+                digest.update(f"{graph_name} {rdf_format}\n".encode('utf-8'))
+                digest.update(rdf.encode('utf-8'))
+        return digest.hexdigest()
+
+    def materialize(self, entailment: str = None, inferred_graph: str = None):
+        """Materialize the RDFS or OWL-RL closure of the data, e.g. after updates.
+
+        Defaults to the entailment and inferred graph the endpoint was created with.
+        When an inferred graph is used, it is recomputed from scratch. Otherwise newly
+        entailed triples are added to the default graph, and inferences from deleted
+        data are kept.
+        """
+        # Optional dependency, only needed when entailment is requested
+        from sparql_endpoint_fixture.entailment import materialize_closure
+
+        entailment = entailment or self.entailment or 'rdfs'
+        inferred_graph = inferred_graph or self.inferred_graph
+
+        if inferred_graph:
+            self.graph.remove((None, None, None, self.graph.get_context(URIRef(inferred_graph))))
+        materialize_closure(self.graph, entailment, inferred_graph)
+
+    @property
+    def statistics(self) -> Dict[Optional[URIRef], GraphStatistics]:
+        """Cardinality statistics for the union graph (keyed by None) and each named graph.
+
+        Built on first use, then updated as triples are added and removed.
+        """
+        return self.graph.store.statistics
+
+    def _default_graph_statistics(self) -> Optional[URIRef]:
+        """Statistics key for BGPs evaluated against the default graph."""
+        return None if sparql_options.SPARQL_DEFAULT_GRAPH_UNION else self.graph.default_context.identifier
+
+    def explain(self, query: str) -> str:
+        """Describe the evaluation order chosen for each BGP in the query, with estimated cardinalities."""
+        with PARSE_LOCK:
+            parsed_query = prepareQuery(query)
+        return '\n'.join(reorder_bgps(parsed_query.algebra, self.statistics, self._default_graph_statistics()))
+
     def _predefined_value(self, path: str) -> PredefinedResponse:
         """Determine if path is an exact or regex match for a predefined handler."""
         if self.predefined:
@@ -73,6 +185,113 @@ class Endpoint:
              if isinstance(regex, re.Pattern) and regex.fullmatch(path)),
             None)
 
+    @classmethod
+    def registered(cls, uri: str) -> Optional['Endpoint']:
+        """Find the endpoint registered for a URI, by exact or regex match."""
+        # URIs are matched without the query string, as httpretty does
+        base_uri = uri.split('?')[0]
+        if base_uri in cls.registry:
+            return cls.registry[base_uri]
+        return next(
+            (endpoint
+             for registered_uri, endpoint in cls.registry.items()
+             if isinstance(registered_uri, re.Pattern)
+             and (registered_uri.fullmatch(base_uri) or registered_uri.fullmatch(uri))),
+            None)
+
+    @classmethod
+    def evaluate_service(cls, ctx: QueryContext, part: CompValue):
+        """rdflib custom evaluation hook routing SERVICE clauses to registered endpoints.
+
+        A join against a SERVICE clause is evaluated as a bound join, so that the
+        solutions on the left are pushed down in batches. Anything else is left to rdflib.
+        """
+        if part.name == 'Join' and part.p2.name == 'ServiceGraphPattern' and isinstance(part.p2.term, URIRef):
+            target = cls.registered(str(part.p2.term))
+            if target is not None:
+                return target._service_join(ctx, evalPart(ctx, part.p1), part.p2)
+        elif part.name == 'ServiceGraphPattern' and isinstance(part.term, URIRef):
+            target = cls.registered(str(part.term))
+            if target is not None:
+                return target._service_join(ctx, [ctx.solution()], part)
+        raise NotImplementedError()
+
+    def _service_join(self, ctx: QueryContext,
+                      solutions: Iterable[FrozenBindings],
+                      service: CompValue) -> Iterable[FrozenBindings]:
+        """Join solutions with a SERVICE clause evaluated against this endpoint's graph."""
+        # Extracted up front, so that a failure is reported even for SERVICE SILENT
+        pattern = self._service_pattern(service)
+        solutions = iter(solutions)
+        while True:
+            batch = list(itertools.islice(solutions, self.SERVICE_BATCH_SIZE))
+            if not batch:
+                return
+            try:
+                remote = self._service_bindings(ctx, service, pattern, batch)
+            except Exception:
+                if 'silent' not in service:
+                    raise
+                # A failed SILENT service yields a single empty solution
+                remote = [[{}]] * len(batch)
+            for local, rows in zip(batch, remote):
+                for row in rows:
+                    if local.compatible(row):
+                        yield local.merge(row)
+
+    @staticmethod
+    def _service_pattern(service: CompValue) -> str:
+        """The text of the group graph pattern in a SERVICE clause."""
+        # Neither IRIs nor prefixed names can contain braces, so the pattern is everything
+        # between the first opening brace and the last closing one
+        text = service.service_string
+        start, end = text.find('{'), text.rfind('}')
+        if start < 0 or end < start:
+            raise ValueError(f"Unable to find the graph pattern in {text}")
+        return text[start + 1:end]
+
+    def _service_bindings(self, ctx: QueryContext,
+                          service: CompValue,
+                          pattern: str,
+                          batch: List[FrozenBindings]) -> List[List[dict]]:
+        """Evaluate the SERVICE pattern for a batch of solutions, passed in as a VALUES block.
+
+        Returns the remote solutions for each solution in the batch, in order.
+        """
+
+        # Only variables bound to IRIs or literals can be pushed down, blank nodes are left UNDEF
+        # and matched up when the results are joined back with the batch
+        shared = sorted(var for var in service._vars if any(local.get(var) is not None for local in batch))
+        keys = [' '.join('UNDEF' if local.get(var) is None or isinstance(local.get(var), BNode)
+                         else local.get(var).n3() for var in shared)
+                for local in batch]
+        values = ''
+        if shared:
+            # Each distinct row is tagged with its index, so that remote solutions matched through
+            # an UNDEF are only joined back with the solutions that produced that row
+            row_ids = {key: row_id for row_id, key in enumerate(dict.fromkeys(keys))}
+            values = 'VALUES (' + ' '.join(var.n3() for var in shared) + f' {SERVICE_ROW.n3()}) {{ ' + \
+                     ' '.join(f'({key} {row_id})' for key, row_id in row_ids.items()) + ' }'
+
+        prologue = ''
+        if ctx.prologue is not None:
+            if ctx.prologue.base:
+                prologue += f'BASE <{ctx.prologue.base}> '
+            prologue += ''.join(f'PREFIX {prefix}: {namespace.n3()} '
+                                for prefix, namespace in ctx.prologue.namespace_manager.namespaces())
+        query = f'{prologue}SELECT * WHERE {{ {values} {{ {pattern} }} }}'
+        with PARSE_LOCK:
+            parsed_query = prepareQuery(query)
+        bindings = self.graph.query(parsed_query).bindings
+        if not shared:
+            return [bindings] * len(batch)
+
+        rows_by_id = [[] for _ in row_ids]
+        for row in bindings:
+            row = dict(row)
+            rows_by_id[int(row.pop(SERVICE_ROW))].append(row)
+        return [rows_by_id[row_ids[key]] for key in keys]
+
     def _predefined_response(
         self,
         predefined_response: PredefinedResponse,
@@ -85,6 +304,16 @@ class Endpoint:
             return applied
         return predefined_response
 
+    def handle_request(self, request: HTTPrettyRequest, url: str) -> RequestResult:
+        """Handle a request intercepted by a transport other than httpretty."""
+        if request.method == 'GET':
+            status, headers, body = self._handle_get(request, url, {})
+        elif request.method == 'POST':
+            status, headers, body = self._handle_post(request, url, {})
+        else:
+            status, headers, body = 405, {}, f"Unsupported method: {request.method}"
+        return status, headers, body
+
     def _handle_post(self, request: HTTPrettyRequest,
                     url: str,
                     ret_headers: dict) -> list:
@@ -180,7 +409,8 @@ class Endpoint:
     def _process_query(self, query, results_format=None,
                       graph_uris=None, named_graph_uris=None) -> Tuple[int, dict, str]:
         try:
-            parsed_query = prepareQuery(query)
+            with PARSE_LOCK:
+                parsed_query = prepareQuery(query)
         except ParseException as pe:
             return 400, {}, f"Malformed query: {pe} in {query}"
 
@@ -207,6 +437,11 @@ class Endpoint:
         if mapped_format is None:
             return 415, {}, f"Unsupported result type {results_format}"
 
+        if self.optimize and needs_reordering(parsed_query.algebra):
+            plan = reorder_bgps(parsed_query.algebra, self.statistics, self._default_graph_statistics())
+            if self.explain_queries:
+                print('Evaluation order for ', query, '\n', '\n'.join(plan))
+
         try:
             results = self.graph.query(parsed_query)
             if parsed_query.algebra.name == 'SelectQuery':
@@ -222,7 +457,8 @@ class Endpoint:
 
     def _process_update(self, query, graph_uris=None, named_graph_uris=None) -> (int, dict, str):
         try:
-            parsed_query = translateUpdate(parseUpdate(query))
+            with PARSE_LOCK:
+                parsed_query = translateUpdate(parseUpdate(query))
         except ParseException as pe:
             return 400, {}, f"Malformed UPDATE: {pe} in {query}"
 
@@ -243,13 +479,21 @@ class Endpoint:
 
 
 @pytest.fixture
-def sparql_endpoint():
+def sparql_endpoint(request):
     """Enable request interception, disable on teardown."""
+    # Materialized entailment is cached alongside the rest of the pytest cache, when it is enabled
+    cache = getattr(request.config, 'cache', None)
+    entailment_cache = str(cache.mkdir('sparql_endpoint_entailment')) if cache is not None else None
     httpretty.set_default_thread_timeout(60)
     httpretty.enable(verbose=True,
                      allow_net_connect=False)  # enable HTTPretty so that it will monkey patch the socket module
+    # Evaluate SERVICE clauses aimed at other fixture endpoints in-process
+    sparql_options.CUSTOM_EVALS['sparql_endpoint_fixture_service'] = Endpoint.evaluate_service
 
-    yield lambda uri, initial_data, **kwargs: Endpoint(uri, initial_data, **kwargs)
+    yield lambda uri, initial_data, **kwargs: Endpoint(uri, initial_data,
+                                                       **{'entailment_cache': entailment_cache, **kwargs})
 
     httpretty.disable()  # disable afterwards, so that you will have no problems in code that uses that socket module
     httpretty.reset()  # reset HTTPretty state (clean up registered urls and request history)
+    sparql_options.CUSTOM_EVALS.pop('sparql_endpoint_fixture_service', None)
+    Endpoint.registry.clear()
@@ -0,0 +1,28 @@
+"""RDFS and OWL-RL entailment materialization for endpoint data."""
+import owlrl
+from rdflib import ConjunctiveGraph, Graph, URIRef
+
+# Identifies the reasoner and cache format that produced a cached closure
+CLOSURE_VERSION = f"owlrl {owlrl.__version__}, trig 1"
+
+ENTAILMENT_REGIMES = {
+    'rdfs': owlrl.RDFS_Semantics,
+    'owlrl': owlrl.OWLRL_Semantics
+}
+
+
+def materialize_closure(dataset: ConjunctiveGraph, entailment: str, inferred_graph: str = None):
+    """Add the closure of all triples in the dataset to the inferred graph, or the default graph."""
+    if entailment not in ENTAILMENT_REGIMES:
+        raise ValueError(f"Unsupported entailment {entailment}, expected one of {', '.join(ENTAILMENT_REGIMES)}")
+
+    # Reason over the union of all graphs, keeping only the triples that were not already asserted
+    closure = Graph()
+    for triple in dataset.triples((None, None, None)):
+        closure.add(triple)
+    owlrl.DeductiveClosure(ENTAILMENT_REGIMES[entailment]).expand(closure)
+
+    target = dataset.get_context(URIRef(inferred_graph)) if inferred_graph else dataset
+    for triple in closure:
+        if triple not in dataset:
+            target.add(triple)
@@ -0,0 +1,255 @@
+"""Cardinality statistics and selectivity-based reordering of basic graph patterns."""
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from rdflib import BNode, URIRef, Variable
+from rdflib.namespace import RDF
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.stores.memory import Memory
+from rdflib.term import Node
+
+Triple = Tuple[Node, Node, Node]
+
+
+class GraphStatistics:
+    """Triple, predicate and class counts for a graph, used to estimate pattern cardinality.
+
+    Counts are kept per subject and object so that they can be maintained as triples are removed.
+    """
+
+    def __init__(self, triples: Iterable[Triple] = ()):
+        self.size = 0
+        self.predicates = Counter()
+        self.classes = Counter()
+        self._subjects = Counter()
+        self._objects = Counter()
+        # Occurrences of each (predicate, subject) and (predicate, object) pair,
+        # and the number of distinct pairs for each predicate
+        self._predicate_subjects = Counter()
+        self._predicate_objects = Counter()
+        self._distinct_subjects = Counter()
+        self._distinct_objects = Counter()
+        self.extend(triples)
+
+    def extend(self, triples: Iterable[Triple]):
+        """Count triples in bulk, which is much faster than adding them one by one."""
+        subjects, predicates, objects = list(zip(*triples)) or ((), (), ())
+        self.size += len(predicates)
+        self.predicates.update(predicates)
+        self.classes.update(o for p, o in zip(predicates, objects) if p == RDF.type)
+        self._subjects.update(subjects)
+        self._objects.update(objects)
+        self._predicate_subjects.update(zip(predicates, subjects))
+        self._predicate_objects.update(zip(predicates, objects))
+        self._count_distinct()
+
+    def merge(self, other: 'GraphStatistics'):
+        """Add the counts of another graph, e.g. to build the statistics for a union of graphs."""
+        self.size += other.size
+        for name in ('predicates', 'classes', '_subjects', '_objects', '_predicate_subjects', '_predicate_objects'):
+            getattr(self, name).update(getattr(other, name))
+        self._count_distinct()
+
+    def _count_distinct(self):
+        self._distinct_subjects = Counter(p for p, _ in self._predicate_subjects)
+        self._distinct_objects = Counter(p for p, _ in self._predicate_objects)
+
+    def add(self, triple: Triple):
+        s, p, o = triple
+        self.size += 1
+        self.predicates[p] += 1
+        if p == RDF.type:
+            self.classes[o] += 1
+        self._subjects[s] += 1
+        self._objects[o] += 1
+        if _increment(self._predicate_subjects, (p, s)):
+            self._distinct_subjects[p] += 1
+        if _increment(self._predicate_objects, (p, o)):
+            self._distinct_objects[p] += 1
+
+    def remove(self, triple: Triple):
+        s, p, o = triple
+        self.size -= 1
+        _decrement(self.predicates, p)
+        if p == RDF.type:
+            _decrement(self.classes, o)
+        _decrement(self._subjects, s)
+        _decrement(self._objects, o)
+        if _decrement(self._predicate_subjects, (p, s)):
+            _decrement(self._distinct_subjects, p)
+        if _decrement(self._predicate_objects, (p, o)):
+            _decrement(self._distinct_objects, p)
+
+    def estimate(self, triple: Triple, bound: Set[Node]) -> float:
+        """Estimate the number of solutions for a triple pattern, given the variables already bound."""
+        s, p, o = triple
+        s_bound, o_bound = _is_bound(s, bound), _is_bound(o, bound)
+        if p == RDF.type and not isinstance(o, (Variable, BNode)):
+            cardinality = self.classes.get(o, 0)
+            return cardinality / max(len(self._subjects), 1) if s_bound else cardinality
+        if isinstance(p, URIRef):
+            cardinality = self.predicates.get(p, 0)
+            subjects, objects = self._distinct_subjects.get(p, 0), self._distinct_objects.get(p, 0)
+        else:
+            # Unbound predicate or property path
+            cardinality = self.size
+            subjects, objects = len(self._subjects), len(self._objects)
+            if p in bound:
+                cardinality /= max(len(self.predicates), 1)
+        if s_bound:
+            cardinality /= max(subjects, 1)
+        if o_bound:
+            cardinality /= max(objects, 1)
+        return cardinality
+
+
+def _increment(counter: Counter, key) -> bool:
+    """Count a key, returning whether it is new."""
+    counter[key] += 1
+    return counter[key] == 1
+
+
+def _decrement(counter: Counter, key) -> bool:
+    """Uncount a key, returning whether it is gone."""
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+        return True
+    return False
+
+
+class StatisticsMemory(Memory):
+    """In-memory store that keeps cardinality statistics up to date as triples are added and removed.
+
+    Statistics for the union of all graphs (keyed by None) and each graph are built on first use.
+    """
+
+    def __init__(self, configuration=None, identifier=None):
+        super().__init__(configuration, identifier)
+        self._statistics = None
+        # Requests may be handled concurrently, so the build and every change to the data
+        # are serialized to keep the counts in step with the store
+        self._statistics_lock = threading.RLock()
+
+    @property
+    def statistics(self) -> Dict[Optional[Node], GraphStatistics]:
+        with self._statistics_lock:
+            if self._statistics is None:
+                statistics = {
+                    _identifier(context): GraphStatistics(
+                        triple for triple, _ in self.triples((None, None, None), context))
+                    for context in self.contexts()}
+                union = GraphStatistics()
+                for graph_statistics in statistics.values():
+                    union.merge(graph_statistics)
+                statistics[None] = union
+                self._statistics = statistics
+            return self._statistics
+
+    def add(self, triple: Triple, context, quoted: bool = False):
+        with self._statistics_lock:
+            if self._statistics is not None and context is not None and not quoted \
+                    and next(self.triples(triple, context), None) is None:
+                update_statistics(self._statistics, triple, _identifier(context))
+            super().add(triple, context, quoted)
+
+    def remove(self, triple_pattern, context=None):
+        with self._statistics_lock:
+            if self._statistics is not None:
+                graph = _identifier(context)
+                removed = [(triple, _identifier(triple_context))
+                           for triple, contexts in self.triples(triple_pattern, context)
+                           for triple_context in contexts
+                           if context is None or _identifier(triple_context) == graph]
+                for triple, triple_graph in removed:
+                    update_statistics(self._statistics, triple, triple_graph, added=False)
+            super().remove(triple_pattern, context)
+
+
+def _identifier(context) -> Optional[Node]:
+    return getattr(context, 'identifier', context)
+
+
+def update_statistics(statistics: Dict[Optional[Node], GraphStatistics],
+                      triple: Triple, graph: Node, added: bool = True):
+    """Count a triple added to, or removed from, a graph and the union of all graphs."""
+    for key in (None, graph):
+        graph_statistics = statistics.setdefault(key, GraphStatistics())
+        if added:
+            graph_statistics.add(triple)
+        else:
+            graph_statistics.remove(triple)
+
+
+def _is_bound(term: Node, bound: Set[Node]) -> bool:
+    return not isinstance(term, (Variable, BNode)) or term in bound
+
+
+def _variables(triple: Triple) -> Set[Node]:
+    # Blank nodes in query patterns behave as variables
+    return {term for term in triple if isinstance(term, (Variable, BNode))}
+
+
+def reorder_triples(triples: List[Triple], statistics: GraphStatistics) -> List[Tuple[Triple, float]]:
+    """Greedily order triple patterns by estimated cardinality, avoiding cartesian products where possible."""
+    remaining = list(triples)
+    bound = set()
+    ordered = []
+    while remaining:
+        connected = [triple for triple in remaining if _variables(triple) & bound]
+        estimates = [(statistics.estimate(triple, bound), index, triple)
+                     for index, triple in enumerate(connected or remaining)]
+        estimate, _, best = min(estimates, key=lambda candidate: candidate[:2])
+        ordered.append((best, estimate))
+        remaining.remove(best)
+        bound |= _variables(best)
+    return ordered
+
+
+def _bgps(part, graph: Node = None) -> Iterable[Tuple[CompValue, Optional[Node]]]:
+    """Yield every BGP in the algebra, with the GRAPH term it is evaluated under, if any."""
+    if isinstance(part, CompValue):
+        if part.name == 'Graph':
+            graph = part.term
+        if part.name == 'BGP':
+            yield part, graph
+        for value in part.values():
+            yield from _bgps(value, graph)
+    elif isinstance(part, list):
+        for value in part:
+            yield from _bgps(value, graph)
+
+
+def needs_reordering(algebra) -> bool:
+    """Whether the algebra has any BGP with more than one triple pattern."""
+    return any(len(bgp.triples) > 1 for bgp, _ in _bgps(algebra))
+
+
+def reorder_bgps(algebra, statistics: Dict[Optional[Node], GraphStatistics],
+                 default_graph: Node = None) -> List[str]:
+    """Reorder all BGPs in the algebra in place, returning a description of the chosen orders.
+
+    BGPs outside a GRAPH pattern are estimated using the statistics for default_graph,
+    or for the union of all graphs when it is None.
+    """
+    plan = []
+    for bgp, graph in _bgps(algebra):
+        if len(bgp.triples) < 2:
+            continue
+        if graph is None:
+            label = 'default graph'
+            graph_statistics = statistics.get(default_graph, GraphStatistics())
+        elif isinstance(graph, URIRef):
+            label = f"GRAPH {graph.n3()}"
+            graph_statistics = statistics.get(graph, GraphStatistics())
+        else:
+            # The graph is only known at evaluation time
+            label = f"GRAPH {graph.n3()}"
+            graph_statistics = statistics[None]
+        ordered = reorder_triples(bgp.triples, graph_statistics)
+        bgp['triples'] = [triple for triple, _ in ordered]
+        plan.append(f"BGP in {label}:")
+        plan.extend(f"  {estimate:>12.1f}  {' '.join(term.n3() for term in triple)}"
+                    for triple, estimate in ordered)
+    return plan
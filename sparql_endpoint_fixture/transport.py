@@ -0,0 +1,39 @@
+"""httpx transport routing async requests to fixture endpoints."""
+import asyncio
+from concurrent.futures import Executor
+
+import httpx
+from httpretty.core import HTTPrettyRequest
+
+from sparql_endpoint_fixture.endpoint import Endpoint
+
+
+class AsyncEndpointTransport(httpx.AsyncBaseTransport):
+    """Routes httpx.AsyncClient requests to the registered endpoint matching the request URL.
+
+    Requests are evaluated in an executor, so that queries from concurrent coroutines
+    can be in flight without blocking the event loop.
+    """
+
+    def __init__(self, executor: Executor = None):
+        self.executor = executor
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        endpoint = Endpoint.registered(url)
+        if endpoint is None:
+            raise httpx.ConnectError(f"No endpoint registered for {url}", request=request)
+
+        # Present the request the way httpretty would, so that endpoint handling
+        # (including predefined response callables) is shared with the sync path
+        body = await request.aread()
+        header_lines = ''.join(f"{name}: {value}\r\n" for name, value in request.headers.multi_items())
+        raw_path = request.url.raw_path.decode('ascii')
+        pretty_request = HTTPrettyRequest(f"{request.method} {raw_path} HTTP/1.1\r\n{header_lines}\r\n", body)
+
+        loop = asyncio.get_running_loop()
+        status, headers, text = await loop.run_in_executor(
+            self.executor, endpoint.handle_request, pretty_request, url)
+        return httpx.Response(status, headers=headers,
+                              content=text.encode('utf-8') if isinstance(text, str) else text,
+                              request=request)
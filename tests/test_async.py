@@ -0,0 +1,113 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from sparql_endpoint_fixture.transport import AsyncEndpointTransport
+
+
+def test_async_concurrent_queries(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    endpoint = sparql_endpoint(repo_uri, rdf_files)  # noqa: F841
+    query = "select (count(?person) as ?num) where { ?person a <http://example.com/Person> }"
+
+    async def run_queries():
+        async with httpx.AsyncClient(transport=AsyncEndpointTransport()) as client:
+            return await asyncio.gather(*(
+                client.get(repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+                for _ in range(50)))
+
+    responses = asyncio.run(run_queries())
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()['results']['bindings'][0]['num']['value'] == '1' for response in responses)
+
+
+def test_async_update_post(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    endpoint = sparql_endpoint(repo_uri, rdf_files)  # noqa: F841
+    update = "insert { ?instance a ?super } " \
+             "where { ?instance a/<http://www.w3.org/2000/01/rdf-schema#subClassOf> ?super }"
+    query = "select (count(?person) as ?num) where { ?person a <http://example.com/Person> }"
+
+    async def run_update():
+        async with httpx.AsyncClient(transport=AsyncEndpointTransport()) as client:
+            response = await client.post(repo_uri, content=update,
+                                         headers={'Content-Type': 'application/sparql-update'})
+            assert response.status_code == 200
+            return await client.post(repo_uri, data={'query': query}, headers={'Accept': 'application/json'})
+
+    response = asyncio.run(run_update())
+    assert response.json()['results']['bindings'][0]['num']['value'] == '3'
+
+
+def test_async_predefined(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/'
+    endpoint = sparql_endpoint(  # noqa: F841
+        re.compile(repo_uri + '.*'),
+        [],
+        predefined={
+            re.compile(r'/repo/admin/.*'): lambda r: (200, {}, r.path[15:])
+        }
+    )
+
+    async def run_request():
+        async with httpx.AsyncClient(transport=AsyncEndpointTransport()) as client:
+            return await client.get(repo_uri + 'admin/db/test')
+
+    response = asyncio.run(run_request())
+    assert response.status_code == 200
+    assert response.text == 'test'
+
+
+def test_async_query_off_event_loop(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/'
+    released = threading.Event()
+    endpoint = sparql_endpoint(  # noqa: F841
+        re.compile(repo_uri + '.*'),
+        [],
+        predefined={
+            # Only completes once the event loop has been able to run another coroutine
+            '/repo/slow': lambda r: (200 if released.wait(5) else 504, {}, '')
+        }
+    )
+    executor = ThreadPoolExecutor(max_workers=2)
+    submitted = []
+    submit = executor.submit
+    executor.submit = lambda *args, **kwargs: submitted.append(args) or submit(*args, **kwargs)
+
+    async def release():
+        await asyncio.sleep(0.01)
+        released.set()
+
+    async def run_request():
+        async with httpx.AsyncClient(transport=AsyncEndpointTransport(executor)) as client:
+            response, _ = await asyncio.gather(client.get(repo_uri + 'slow'), release())
+            return response
+
+    response = asyncio.run(run_request())
+    executor.shutdown()
+    assert response.status_code == 200
+    assert len(submitted) == 1
+
+
+def test_async_regex_endpoint_query(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    endpoint = sparql_endpoint(re.compile(r'https://my\.rdfdb\.com/repo/sparql'),  # noqa: F841
+                               ['tests/instance_data.ttl'])
+    query = "ask { ?s ?p ?o }"
+
+    async def run_query():
+        async with httpx.AsyncClient(transport=AsyncEndpointTransport()) as client:
+            return await client.get(repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+
+    response = asyncio.run(run_query())
+    assert response.status_code == 200
+    assert response.json()['boolean'] is True
@@ -0,0 +1,89 @@
+import os
+
+import requests
+
+from sparql_endpoint_fixture import entailment
+
+PERSON_COUNT = "select (count(distinct ?person) as ?num) where { ?person a <http://example.com/Person> }"
+
+
+def _person_count(repo_uri, graph_uri=None):
+    params = {'query': PERSON_COUNT}
+    if graph_uri:
+        params['default-graph-uri'] = graph_uri
+    response = requests.get(url=repo_uri, params=params, headers={'Accept': 'application/json'})
+    return int(response.json()['results']['bindings'][0]['num']['value'])
+
+
+def test_rdfs_default_graph(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    endpoint = sparql_endpoint(repo_uri, rdf_files, entailment='rdfs', entailment_cache=None)  # noqa: F841
+    assert _person_count(repo_uri) == 3
+
+
+def test_rdfs_inferred_graph(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    inferred_graph = 'http://example.com/graph/inferred'
+    endpoint = sparql_endpoint(repo_uri, rdf_files, entailment='rdfs', inferred_graph=inferred_graph,
+                               entailment_cache=None, default_graph_union=False)
+    assert _person_count(repo_uri) == 1
+    assert _person_count(repo_uri, inferred_graph) == 2
+    assert len(endpoint.graph.get_context(inferred_graph)) > 0
+
+
+def test_cached_closure(sparql_endpoint, tmp_path, monkeypatch):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    first = sparql_endpoint(repo_uri, rdf_files, entailment='owlrl', entailment_cache=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+
+    def fail(*args):
+        raise AssertionError("Closure should be loaded from the cache")
+
+    monkeypatch.setattr(entailment, 'materialize_closure', fail)
+    second = sparql_endpoint(repo_uri, rdf_files, entailment='owlrl', entailment_cache=str(tmp_path))
+    assert len(second.graph) == len(first.graph)
+    assert _person_count(repo_uri) == 3
+
+
+def test_cache_keyed_by_reasoner(sparql_endpoint, tmp_path, monkeypatch):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/domain_ontology.ttl', 'tests/instance_data.ttl']
+    sparql_endpoint(repo_uri, rdf_files, entailment='rdfs', entailment_cache=str(tmp_path))
+    monkeypatch.setattr(entailment, 'CLOSURE_VERSION', 'owlrl 0.0.0, trig 1')
+    sparql_endpoint(repo_uri, rdf_files, entailment='rdfs', entailment_cache=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_rematerialize_inferred_graph(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    inferred_graph = 'http://example.com/graph/inferred'
+    endpoint = sparql_endpoint(repo_uri, rdf_files, entailment='owlrl', inferred_graph=inferred_graph,
+                               entailment_cache=None)
+    default_size = len(endpoint.graph.default_context)
+    inferred_size = len(endpoint.graph.get_context(inferred_graph))
+
+    update = "insert data { <http://example.com/_t2> a <http://example.com/Teacher> }"
+    response = requests.get(url=repo_uri, params={'update': update})
+    assert response.status_code == 200
+    endpoint.materialize()
+    assert len(endpoint.graph.default_context) == default_size + 1
+    assert len(endpoint.graph.get_context(inferred_graph)) > inferred_size
+
+    delete = "delete data { <http://example.com/_t2> a <http://example.com/Teacher> }"
+    response = requests.get(url=repo_uri, params={'update': delete})
+    assert response.status_code == 200
+    endpoint.materialize()
+    assert len(endpoint.graph.default_context) == default_size
+    assert len(endpoint.graph.get_context(inferred_graph)) == inferred_size
@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import requests
+from rdflib import RDF, URIRef
+
+from sparql_endpoint_fixture.transport import AsyncEndpointTransport
+
+
+def test_explain_order(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    endpoint = sparql_endpoint(repo_uri, rdf_files)
+    query = "select * where { ?s ?p ?o . ?x a ?type . ?x <http://example.com/hasPhoneNumber> ?phone }"
+    plan = endpoint.explain(query).splitlines()
+    assert plan[0] == 'BGP in default graph:'
+    assert plan[1].endswith('?x <http://example.com/hasPhoneNumber> ?phone')
+    assert plan[2].endswith('?x <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> ?type')
+    assert plan[3].endswith('?s ?p ?o')
+
+
+def test_reordered_results(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = ['tests/upper_ontology.ttl',
+                 'tests/domain_ontology.ttl',
+                 'tests/instance_data.ttl']
+    endpoint = sparql_endpoint(repo_uri, rdf_files)
+    query = "select ?x ?type ?friend where { ?x a ?type . ?x <http://example.com/isFriendOf> ?friend }"
+    response = requests.get(url=repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+    results = set(
+        (row['x']['value'], row['type']['value'], row['friend']['value'])
+        for row in response.json()['results']['bindings'])
+
+    expected = set((str(x), str(type_), str(friend)) for x, type_, friend in endpoint.graph.query(query))
+    assert results == expected
+
+
+def test_statistics_update(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = [{'http://example.com/graph/instance': 'tests/instance_data.ttl'}]
+    endpoint = sparql_endpoint(repo_uri, rdf_files)
+    graph = URIRef('http://example.com/graph/instance')
+    assert endpoint.statistics[graph].predicates[RDF.type] == 5
+
+    update = "insert data { graph <http://example.com/graph/instance> " \
+             "{ <http://example.com/_t2> a <http://example.com/Teacher> } }"
+    response = requests.get(url=repo_uri, params={'update': update})
+    assert response.status_code == 200
+    assert endpoint.statistics[graph].predicates[RDF.type] == 6
+
+    delete = "delete where { graph <http://example.com/graph/instance> { ?s a <http://example.com/Teacher> } }"
+    response = requests.get(url=repo_uri, params={'update': delete})
+    assert response.status_code == 200
+    assert endpoint.statistics[graph].predicates[RDF.type] == 4
+    assert endpoint.statistics[None].predicates[RDF.type] == 4
+
+
+def test_explain_graphs(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    rdf_files = [{'http://example.com/graph/instance': 'tests/instance_data.ttl'}]
+    endpoint = sparql_endpoint(repo_uri, rdf_files, default_graph_union=False)
+    query = "select * where { ?a ?b ?c . ?a a ?d " \
+            "graph ?g { ?s ?p ?o . ?s a ?t } " \
+            "graph <http://example.com/graph/instance> { ?x ?y ?z . ?x a ?c } }"
+    plan = endpoint.explain(query).splitlines()
+    assert 'BGP in GRAPH ?g:' in plan
+    assert 'BGP in GRAPH <http://example.com/graph/instance>:' in plan
+    # The default graph is empty when it is not the union of all graphs
+    default_graph = plan.index('BGP in default graph:')
+    assert [float(line.split()[0]) for line in plan[default_graph + 1:default_graph + 3]] == [0.0, 0.0]
+
+
+def test_statistics_concurrent_updates(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    endpoint = sparql_endpoint(repo_uri, ['tests/instance_data.ttl'])
+    predicate = URIRef('http://example.com/p')
+    # Enough data for the first statistics build to overlap with the updates
+    for i in range(20000):
+        endpoint.graph.add((URIRef(f'http://example.com/o{i}'), RDF.value, URIRef(f'http://example.com/v{i % 100}')))
+    # Multi-pattern queries build the statistics while the updates are in flight
+    query = "select * where { ?s ?p ?o . ?s a ?type }"
+
+    async def run_requests():
+        async with httpx.AsyncClient(transport=AsyncEndpointTransport()) as client:
+            return await asyncio.gather(*(
+                request
+                for i in range(100)
+                for request in (
+                    client.post(repo_uri, content=f"insert data {{ <http://example.com/s{i}> <{predicate}> {i} }}",
+                                headers={'Content-Type': 'application/sparql-update'}),
+                    client.get(repo_uri, params={'query': query}, headers={'Accept': 'application/json'}))))
+
+    responses = asyncio.run(run_requests())
+    assert all(response.status_code == 200 for response in responses)
+    assert endpoint.statistics[None].predicates[predicate] == 100
+    assert endpoint.statistics[None].size == len(endpoint.graph)
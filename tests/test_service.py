@@ -0,0 +1,85 @@
+from collections import Counter
+
+import requests
+
+
+def test_service_join(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    other_uri = 'https://other.rdfdb.com/repo/sparql'
+    endpoint = sparql_endpoint(repo_uri, ['tests/instance_data.ttl'])  # noqa: F841
+    other = sparql_endpoint(other_uri, ['tests/upper_ontology.ttl', 'tests/domain_ontology.ttl'])  # noqa: F841
+    query = "select ?instance ?super where { ?instance a ?class " \
+            f"SERVICE <{other_uri}> {{ ?class <http://www.w3.org/2000/01/rdf-schema#subClassOf> ?super }} }}"
+    response = requests.get(url=repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    results = Counter(
+        (row['instance']['value'], row['super']['value'])
+        for row in response.json()['results']['bindings'])
+
+    expected = Counter({('http://example.com/_t1', 'http://example.com/Person'): 1,
+                        ('http://example.com/_s1', 'http://example.com/Person'): 1})
+    assert results == expected
+
+
+def test_service_batches(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    other_uri = 'https://other.rdfdb.com/repo/sparql'
+    endpoint = sparql_endpoint(repo_uri, ['tests/instance_data.ttl'])
+    other = sparql_endpoint(other_uri, ['tests/instance_data.ttl'])
+    other.SERVICE_BATCH_SIZE = 2
+    query = "select ?s ?o where { ?s a ?class " \
+            f"SERVICE <{other_uri}> {{ ?s <http://www.w3.org/2000/01/rdf-schema#isDefinedBy> ?o }} }}"
+    response = requests.get(url=repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    assert len(response.json()['results']['bindings']) == len(endpoint.graph.query(
+        "select ?s ?o where { ?s a ?class . ?s <http://www.w3.org/2000/01/rdf-schema#isDefinedBy> ?o }"))
+
+
+def test_service_unbound_shared(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    other_uri = 'https://other.rdfdb.com/repo/sparql'
+    local_data = """
+        @prefix : <http://example.com/> .
+        :a :p 1 ; :k :k1 .
+        :b :p 2 ; :k [] .
+        :c :p 3 .
+    """
+    remote_data = """
+        @prefix : <http://example.com/> .
+        :k1 :r "v1" .
+        :k2 :r "v2" .
+    """
+    endpoint = sparql_endpoint(repo_uri, [local_data])  # noqa: F841
+    other = sparql_endpoint(other_uri, [remote_data])  # noqa: F841
+    # ?k is bound for :a, bound to a blank node for :b and unbound for :c
+    query = "prefix : <http://example.com/> select ?s ?k ?v where { ?s :p ?o OPTIONAL { ?s :k ?k } " \
+            f"SERVICE <{other_uri}> {{ ?k :r ?v }} }}"
+    response = requests.get(url=repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    results = Counter(
+        (row['s']['value'], row['k']['value'], row['v']['value'])
+        for row in response.json()['results']['bindings'])
+
+    expected = Counter({('http://example.com/a', 'http://example.com/k1', 'v1'): 1,
+                        ('http://example.com/c', 'http://example.com/k1', 'v1'): 1,
+                        ('http://example.com/c', 'http://example.com/k2', 'v2'): 1})
+    assert results == expected
+
+
+def test_service_without_whitespace(sparql_endpoint):
+    repo_uri = 'https://my.rdfdb.com/repo/sparql'
+    other_uri = 'https://other.rdfdb.com/repo/sparql'
+    endpoint = sparql_endpoint(repo_uri, ['tests/instance_data.ttl'])  # noqa: F841
+    other = sparql_endpoint(other_uri, ['tests/domain_ontology.ttl'])  # noqa: F841
+    for service in ('SERVICE', 'SERVICE SILENT'):
+        query = "select ?instance ?super where { ?instance a ?class " \
+                f"{service}<{other_uri}>{{?class <http://www.w3.org/2000/01/rdf-schema#subClassOf> ?super}} }}"
+        response = requests.get(url=repo_uri, params={'query': query}, headers={'Accept': 'application/json'})
+        assert response.status_code == 200
+        results = Counter(
+            (row['instance']['value'], row['super']['value'])
+            for row in response.json()['results']['bindings'])
+
+        expected = Counter({('http://example.com/_t1', 'http://example.com/Person'): 1,
+                            ('http://example.com/_s1', 'http://example.com/Person'): 1})
+        assert results == expected